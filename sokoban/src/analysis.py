@@ -0,0 +1,414 @@
+import time
+
+from collections import (deque,
+                         namedtuple)
+
+from .constants import (UP,
+                        DOWN,
+                        LEFT,
+                        RIGHT,
+                        LURD)
+from .sokoban_engine import (Storage,
+                             Wall)
+
+DIRECTIONS = (UP, DOWN, LEFT, RIGHT)
+
+State = namedtuple('State', ['player', 'crates'])
+
+GoalRoom = namedtuple('GoalRoom',
+                      ['door', 'cells', 'goals', 'order', 'parking'])
+
+
+class UnreachableException(Exception):
+    pass
+
+
+class OutOfTimeException(Exception):
+    pass
+
+
+def shift(position, direction):
+    return position[0] + direction[0], position[1] + direction[1]
+
+
+def back(position, direction):
+    return position[0] - direction[0], position[1] - direction[1]
+
+
+def opposite(direction):
+    return -direction[0], -direction[1]
+
+
+def perpendicular(direction):
+    return (direction[1], direction[0]), (-direction[1], -direction[0])
+
+
+class Move(namedtuple('Move', ['pushes'])):
+    # A macro move is a sequence of elementary pushes, each one given as the
+    # crate position before the push and the direction it is pushed in.
+    __slots__ = ()
+
+    def get_destination(self):
+        crate, direction = self.pushes[-1]
+        return shift(crate, direction)
+
+
+class LevelAnalysis:
+    MAX_ROOM_GOALS = 8
+
+    def __init__(self, storage, deadline=None):
+        self.deadline = deadline
+        self.width, self.height = storage.get_dimensions()
+        self.goals = frozenset(storage.final_positions)
+        self.walls = set()
+        for x, column in enumerate(storage.storage_floor):
+            for y, obj in enumerate(column):
+                if isinstance(obj, Wall):
+                    self.walls.add((x, y))
+        self.floor_cells = frozenset(
+            (x, y) for x in range(self.width) for y in range(self.height)
+            if (x, y) not in self.walls)
+        self.initial_state = State(
+            storage.get_player().get_position(),
+            frozenset(crate.get_position() for crate in storage.crates))
+        self.dead_squares = self._find_dead_squares()
+        self.tunnels = self._find_tunnels()
+        self.rooms = self._find_goal_rooms()
+        self.doors = {room.door: room for room in self.rooms}
+        self.room_goals = {}
+        for room in self.rooms:
+            for goal in room.goals:
+                self.room_goals[goal] = room
+
+    @staticmethod
+    def create(plan, deadline=None):
+        Storage.validate(plan)
+        return LevelAnalysis(Storage.create(None, plan), deadline)
+
+    def _check_deadline(self):
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise OutOfTimeException('Level analysis ran out of time')
+
+    def is_floor(self, position):
+        return position in self.floor_cells
+
+    def floor(self):
+        return sorted(self.floor_cells)
+
+    def is_free(self, position, crates):
+        return self.is_floor(position) and position not in crates
+
+    def reachable(self, player, crates, cells=None):
+        seen = {player: None}
+        queue = deque([player])
+        while queue:
+            position = queue.popleft()
+            for direction in DIRECTIONS:
+                neighbour = shift(position, direction)
+                if (neighbour not in seen
+                        and self.is_free(neighbour, crates)
+                        and (cells is None or neighbour in cells)):
+                    seen[neighbour] = position, direction
+                    queue.append(neighbour)
+        return seen
+
+    def walk(self, player, target, crates):
+        seen = self.reachable(player, crates)
+        if target not in seen:
+            raise UnreachableException(
+                'Storekeeper can not reach {}'.format(target))
+        path = []
+        while seen[target] is not None:
+            target, direction = seen[target]
+            path.append(LURD[direction])
+        return ''.join(reversed(path))
+
+    def normalize(self, state):
+        return State(min(self.reachable(*state)), state.crates)
+
+    def is_solved(self, state):
+        return state.crates == self.goals
+
+    def successors(self, state):
+        reach = self.reachable(*state)
+        for crate in state.crates:
+            if crate in self.room_goals:
+                continue
+            for direction in DIRECTIONS:
+                if back(crate, direction) not in reach:
+                    continue
+                move = self.expand_push(crate, direction, state.crates)
+                if move is not None:
+                    yield move, self.apply(state, move)
+
+    def predecessors(self, state):
+        # Pulls: each yields the single push leading back into ``state``.
+        reach = self.reachable(*state)
+        for crate in state.crates:
+            for direction in DIRECTIONS:
+                player = shift(crate, direction)
+                if (player not in reach
+                        or not self.is_free(shift(player, direction),
+                                            state.crates)):
+                    continue
+                crates = set(state.crates)
+                crates.remove(crate)
+                crates.add(player)
+                move = Move(((player, opposite(direction)),))
+                yield move, State(shift(player, direction), frozenset(crates))
+
+    def goal_states(self):
+        regions = set()
+        for position in self.floor():
+            if position in self.goals or position in regions:
+                continue
+            region = self.reachable(position, self.goals)
+            regions.update(region)
+            if any(shift(cell, direction) in self.goals
+                   for cell in region for direction in DIRECTIONS):
+                yield State(min(region), self.goals)
+
+    def expand_push(self, crate, direction, crates):
+        parking = self._parking(crate, direction, crates)
+        if parking is not None:
+            return Move(parking)
+        target = shift(crate, direction)
+        if not self.is_free(target, crates):
+            return None
+        pushes = [(crate, direction)]
+        while ((target, direction) in self.tunnels
+               and self.is_free(shift(target, direction), crates)
+               and not self._is_entrance(target, direction)):
+            pushes.append((target, direction))
+            target = shift(target, direction)
+        parking = self._parking(target, direction, crates)
+        if parking is not None:
+            pushes.extend(parking)
+        elif target in self.dead_squares:
+            return None
+        return Move(tuple(pushes))
+
+    def apply(self, state, move):
+        crates = set(state.crates)
+        player = state.player
+        for crate, direction in move.pushes:
+            crates.remove(crate)
+            crates.add(shift(crate, direction))
+            player = crate
+        return State(player, frozenset(crates))
+
+    def expand(self, state, moves):
+        lurd = []
+        player, crates = state.player, set(state.crates)
+        for move in moves:
+            for crate, direction in move.pushes:
+                lurd.append(self.walk(player, back(crate, direction), crates))
+                lurd.append(LURD[direction].upper())
+                crates.remove(crate)
+                crates.add(shift(crate, direction))
+                player = crate
+        return ''.join(lurd)
+
+    def _is_entrance(self, position, direction):
+        room = self.doors.get(position)
+        return room is not None and shift(position, direction) in room.cells
+
+    def _parking(self, crate, direction, crates):
+        if not self._is_entrance(crate, direction):
+            return None
+        room = self.doors[crate]
+        parked = len(room.goals & crates)
+        if parked == len(room.order):
+            return None
+        if room.goals & crates != set(room.order[:parked]):
+            return None
+        if (room.cells - room.goals) & crates:
+            return None
+        return room.parking.get((parked, direction))
+
+    def _find_dead_squares(self):
+        # Squares from which a lone crate can not be pulled back to a goal.
+        live = set(self.goals)
+        queue = deque(self.goals)
+        while queue:
+            self._check_deadline()
+            crate = queue.popleft()
+            for direction in DIRECTIONS:
+                target = shift(crate, direction)
+                if (target not in live and self.is_floor(target)
+                        and self.is_floor(shift(target, direction))):
+                    live.add(target)
+                    queue.append(target)
+        return self.floor_cells - live
+
+    def _find_tunnels(self):
+        # A crate on a goal-free square walled in on both sides can only be
+        # pushed on or back, and leaving it there just blocks the corridor.
+        # Once it enters such a square it is pushed on until it comes out.
+        tunnels = set()
+        for position in self.floor():
+            if position in self.goals:
+                continue
+            for direction in DIRECTIONS:
+                if not self.is_floor(back(position, direction)):
+                    continue
+                if all(not self.is_floor(shift(position, side))
+                       for side in perpendicular(direction)):
+                    tunnels.add((position, direction))
+        return tunnels
+
+    def _find_doors(self):
+        # Tarjan's articulation points over the storekeeper's part of the
+        # floor in one depth first pass. Every subtree a door cuts off is a
+        # run of consecutive cells in the visiting order.
+        root = self.initial_state.player
+        order = [root]
+        index = {root: 0}
+        low = {root: 0}
+        parent = {root: None}
+        cuts = []
+        stack = [(root, iter(DIRECTIONS))]
+        while stack:
+            self._check_deadline()
+            cell, directions = stack[-1]
+            for direction in directions:
+                neighbour = shift(cell, direction)
+                if not self.is_floor(neighbour):
+                    continue
+                if neighbour not in index:
+                    index[neighbour] = low[neighbour] = len(order)
+                    order.append(neighbour)
+                    parent[neighbour] = cell
+                    stack.append((neighbour, iter(DIRECTIONS)))
+                    break
+                if neighbour != parent[cell]:
+                    low[cell] = min(low[cell], index[neighbour])
+            else:
+                stack.pop()
+                door = parent[cell]
+                if door is None:
+                    continue
+                low[door] = min(low[door], low[cell])
+                if low[cell] >= index[door]:
+                    cuts.append((door, index[cell], len(order)))
+        return order, index, cuts
+
+    def _find_goal_rooms(self):
+        order, index, cuts = self._find_doors()
+        goals = [0]
+        crates = [0]
+        for cell in order:
+            goals.append(goals[-1] + (cell in self.goals))
+            crates.append(crates[-1] + (cell in self.initial_state.crates))
+
+        candidates = []
+        for door, start, stop in cuts:
+            count = goals[stop] - goals[start]
+            if (door in self.goals or not count
+                    or crates[stop] - crates[start]
+                    or count > LevelAnalysis.MAX_ROOM_GOALS):
+                continue
+            candidates.append((stop - start, door, start, stop))
+
+        rooms = []
+        taken = []
+        for _, door, start, stop in sorted(candidates):
+            if any(start < taken_stop and taken_start < stop
+                   or taken_start <= index[door] < taken_stop
+                   or start <= index[taken_door] < stop
+                   or door == taken_door
+                   for taken_door, taken_start, taken_stop in taken):
+                continue
+            room = self._create_room(door, frozenset(order[start:stop]))
+            if room is not None:
+                rooms.append(room)
+                taken.append((door, start, stop))
+        return rooms
+
+    def _create_room(self, door, cells):
+        entries = [direction for direction in DIRECTIONS
+                   if shift(door, direction) in cells
+                   and self.is_floor(back(door, direction))
+                   and back(door, direction) not in cells]
+        if not entries:
+            return None
+        goals = frozenset(cells & self.goals)
+        parking = {}
+        order = self._fill_order(door, cells, goals, entries, [], parking)
+        if order is None:
+            return None
+        return GoalRoom(door, cells, goals, tuple(order), parking)
+
+    def _fill_order(self, door, cells, goals, entries, order, parking):
+        if len(order) == len(goals):
+            return order
+        parked = set(order)
+        depth = self.reachable(door, parked, cells)
+        # Deepest goals first so the ones near the door do not block them.
+        for goal in sorted(goals - parked,
+                           key=lambda g: (-self._distance(depth, g), g)):
+            self._check_deadline()
+            routes = {}
+            for direction in entries:
+                route = self._park(door, direction, goal, cells, parked)
+                if route is None:
+                    break
+                routes[(len(order), direction)] = route
+            else:
+                parking.update(routes)
+                found = self._fill_order(door, cells, goals, entries,
+                                         order + [goal], parking)
+                if found is not None:
+                    return found
+                for key in routes:
+                    del parking[key]
+        return None
+
+    @staticmethod
+    def _distance(tree, position):
+        distance = 0
+        if position not in tree:
+            return distance
+        while tree[position] is not None:
+            position = tree[position][0]
+            distance += 1
+        return distance
+
+    def _park(self, door, direction, goal, cells, parked):
+        # Single crate search inside the room, other parked crates act as
+        # walls. The storekeeper must be able to walk out afterwards.
+        area = cells | {door, back(door, direction)}
+        start = door, back(door, direction)
+        seen = {start: None}
+        queue = deque([start])
+        while queue:
+            self._check_deadline()
+            crate, player = queue.popleft()
+            if crate == goal:
+                if door in self.reachable(player, parked | {goal}, area):
+                    return self._pushes(seen, (crate, player))
+                continue
+            for step in DIRECTIONS:
+                target = shift(player, step)
+                if target not in area or target in parked:
+                    continue
+                next_crate = crate
+                if target == crate:
+                    next_crate = shift(crate, step)
+                    if next_crate not in cells or next_crate in parked:
+                        continue
+                key = next_crate, target
+                if key not in seen:
+                    seen[key] = (crate, player), step
+                    queue.append(key)
+        return None
+
+    @staticmethod
+    def _pushes(tree, key):
+        pushes = []
+        while tree[key] is not None:
+            previous, step = tree[key]
+            if previous[0] != key[0]:
+                pushes.append((previous[0], step))
+            key = previous
+        return tuple(reversed(pushes))
@@ -0,0 +1,280 @@
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import time
+
+from multiprocessing.connection import wait
+from os.path import (exists,
+                     getsize)
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from .analysis import OutOfTimeException
+from .deadlocks import DeadlockStore
+from .settings import (LevelHandler,
+                       Settings)
+from .sokoban_engine import InvalidPlanException
+from .solver import Solver
+
+SOLVED = 'solved'
+UNSOLVABLE = 'unsolvable'
+TIMEOUT = 'timeout'
+OUT_OF_MEMORY = 'memory'
+INVALID = 'invalid'
+ERROR = 'error'
+
+# Results that do not depend on the budget the level was given.
+FINAL_STATUSES = {SOLVED, UNSOLVABLE, INVALID}
+
+# Seconds a worker may overrun its level's time limit before it is killed.
+KILL_GRACE = 5.0
+
+
+def get_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+class ResultCache:
+    CACHE_DIR = 'cache/'
+
+    def __init__(self, path=None):
+        if path is None:
+            path = Settings.get_path(ResultCache.CACHE_DIR)
+        self.path = path
+
+    def _get_file(self, level_hash):
+        return os.path.join(self.path, '{}.json'.format(level_hash))
+
+    def get(self, level_hash):
+        cache_file = self._get_file(level_hash)
+        if not exists(cache_file):
+            return None
+        # A truncated or corrupt entry is a miss; solving again rewrites it.
+        try:
+            with open(cache_file, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, level_hash, record):
+        os.makedirs(self.path, exist_ok=True)
+        cache_file = self._get_file(level_hash)
+        temp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+        with open(temp_file, 'w') as f:
+            json.dump(record, f)
+        os.replace(temp_file, cache_file)
+
+
+def solve_level(task, options):
+    name, path, level_hash = task
+    deadlocks = None
+    record = {'level': name,
+              'path': path,
+              'hash': level_hash,
+              'cached': False}
+    start = time.monotonic()
+    try:
+        if options['deadlocks']:
+            deadlocks = DeadlockStore().load()
+        plan = LevelHandler.load_file(path)
+        solver = Solver.create(plan, options['mode'], options['max_nodes'],
+                               deadlocks, options['time_limit'])
+        result = solver.solve()
+    except (InvalidPlanException, UnicodeDecodeError) as e:
+        record.update(status=INVALID, error=str(e))
+    except OutOfTimeException as e:
+        record.update(status=TIMEOUT, error=str(e))
+    except MemoryError:
+        record.update(status=OUT_OF_MEMORY)
+    except Exception as e:
+        record.update(status=ERROR, error=repr(e))
+    else:
+        record.update(result.marshall())
+        if result.is_solved():
+            record['status'] = SOLVED
+        elif result.exhausted:
+            record['status'] = TIMEOUT
+        else:
+            record['status'] = UNSOLVABLE
+    record['time'] = round(time.monotonic() - start, 3)
+    if deadlocks is not None:
+        record['deadlocks'] = deadlocks.get_stats()
+        # The level's result stands even if the patterns can not be stored.
+        try:
+            deadlocks.save()
+        except Exception as e:
+            record['deadlocks']['error'] = repr(e)
+    return record
+
+
+def _run_worker(connection, task, options):
+    logging.basicConfig()
+    if options['memory_limit'] is not None and resource is not None:
+        limit = options['memory_limit'] * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    connection.send(solve_level(task, options))
+    connection.close()
+
+
+def _create_record(task, status, error):
+    name, path, level_hash = task
+    return {'level': name,
+            'path': path,
+            'hash': level_hash,
+            'cached': False,
+            'status': status,
+            'error': error}
+
+
+def run_tasks(tasks, options, jobs):
+    # One process per level, at most ``jobs`` at a time. A free slot takes
+    # the next level straight away, and a level that overruns its time
+    # limit by more than KILL_GRACE seconds has its process killed.
+    pending = list(reversed(tasks))
+    running = {}
+    try:
+        while pending or running:
+            while pending and len(running) < jobs:
+                task = pending.pop()
+                receiver, sender = multiprocessing.Pipe(duplex=False)
+                process = multiprocessing.Process(
+                    target=_run_worker, args=(sender, task, options),
+                    daemon=True)
+                process.start()
+                sender.close()
+                deadline = None
+                if options['time_limit'] is not None:
+                    deadline = (time.monotonic() + options['time_limit']
+                                + KILL_GRACE)
+                running[receiver] = process, task, deadline
+
+            deadlines = [deadline for _, _, deadline in running.values()
+                         if deadline is not None]
+            timeout = None
+            if deadlines:
+                timeout = max(0, min(deadlines) - time.monotonic())
+            for receiver in wait(list(running), timeout):
+                process, task, _ = running.pop(receiver)
+                try:
+                    record = receiver.recv()
+                except EOFError:
+                    process.join()
+                    record = _create_record(
+                        task, ERROR, 'Worker exited with code {}'.format(
+                            process.exitcode))
+                receiver.close()
+                process.join()
+                yield record
+
+            now = time.monotonic()
+            for receiver, (process, task, deadline) in list(running.items()):
+                if deadline is not None and now >= deadline:
+                    del running[receiver]
+                    process.kill()
+                    process.join()
+                    receiver.close()
+                    yield _create_record(task, TIMEOUT,
+                                         'Worker killed after time limit')
+    finally:
+        for receiver, (process, _, _) in running.items():
+            process.kill()
+            process.join()
+            receiver.close()
+
+
+def collect_tasks(levels, cache):
+    tasks = []
+    finished = []
+    for name, path in LevelHandler.list_directory(levels):
+        task = name, path, None
+        try:
+            with open(path, 'rb') as level_file:
+                level_hash = get_hash(level_file.read())
+        except OSError as e:
+            finished.append(_create_record(task, ERROR, str(e)))
+            continue
+        record = None if cache is None else cache.get(level_hash)
+        if record is not None:
+            record.update(level=name, path=path, cached=True)
+            finished.append(record)
+        else:
+            tasks.append((name, path, level_hash))
+    # Biggest levels first, so a long one does not start last and hold up
+    # the whole batch while the other workers sit idle.
+    tasks.sort(key=lambda task: getsize(task[1]), reverse=True)
+    return tasks, finished
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description='Solve every level in a directory or level file.')
+    parser.add_argument('levels',
+                        help='level file or directory of level files')
+    parser.add_argument('-o', '--output', default='report.jsonl',
+                        help='JSONL report, one line per level')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=os.cpu_count() or 1,
+                        help='number of worker processes')
+    parser.add_argument('-t', '--time-limit', type=float, default=60.0,
+                        help='seconds per level')
+    parser.add_argument('-m', '--memory-limit', type=int, default=None,
+                        help='MiB of address space per worker')
+    parser.add_argument('--max-nodes', type=int, default=None,
+                        help='search nodes per level')
+    parser.add_argument('--mode', choices=Solver.MODES,
+                        default=Solver.FORWARD)
+    parser.add_argument('--no-cache', action='store_true',
+                        help='solve levels even if a cached result exists')
+    parser.add_argument('--no-deadlocks', action='store_true',
+                        help='do not use the deadlock pattern store')
+    parser.add_argument('--fail-fast', action='store_true',
+                        help='stop at the first level that is not solved')
+    return parser
+
+
+def main(argv=None):
+    parser = create_parser()
+    args = parser.parse_args(argv)
+    if not exists(args.levels):
+        parser.error('{} does not exist'.format(args.levels))
+    cache = None if args.no_cache else ResultCache()
+    tasks, finished = collect_tasks(args.levels, cache)
+    if not tasks and not finished:
+        parser.error('no level files found in {}'.format(args.levels))
+    options = {'mode': args.mode,
+               'max_nodes': args.max_nodes,
+               'time_limit': args.time_limit,
+               'memory_limit': args.memory_limit,
+               'deadlocks': not args.no_deadlocks}
+
+    failed = 0
+    with open(args.output, 'w') as report:
+        def write(record):
+            report.write(json.dumps(record))
+            report.write('\n')
+            report.flush()
+
+        for record in finished:
+            write(record)
+            if record['status'] != SOLVED:
+                failed += 1
+
+        records = run_tasks(tasks, options, max(1, args.jobs))
+        try:
+            for record in records:
+                write(record)
+                if cache is not None and record['status'] in FINAL_STATUSES:
+                    cache.put(record['hash'], record)
+                if record['status'] != SOLVED:
+                    failed += 1
+                    if args.fail_fast:
+                        break
+        finally:
+            records.close()
+    return 1 if failed else 0
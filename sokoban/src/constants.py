@@ -11,4 +11,9 @@ VALID_CHARACTERS = {STOREKEEPER,
                     CRATE,
                     WALL,
                     FLOOR,
-                    FINAL_POSITION}
\ No newline at end of file
+                    FINAL_POSITION}
+
+LURD = {LEFT: 'l',
+        UP: 'u',
+        RIGHT: 'r',
+        DOWN: 'd'}
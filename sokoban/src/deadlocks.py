@@ -0,0 +1,220 @@
+import itertools
+import json
+import logging
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from os.path import (dirname,
+                     exists)
+
+from .analysis import shift
+from .constants import (UP,
+                        DOWN,
+                        LEFT,
+                        RIGHT,
+                        CRATE,
+                        WALL)
+from .settings import Settings
+
+logger = logging.getLogger(__name__)
+
+AXES = ((LEFT, RIGHT), (UP, DOWN))
+
+# Every freeze proof has a wall or crate next to the pushed crate on both
+# axes, so the index only looks at those four squares.
+AROUND = (LEFT, RIGHT, UP, DOWN)
+
+# Index marker for a square next to the crate that the pattern does not use.
+ANY = '?'
+
+
+def find_frozen(analysis, crate, crates, blocked=frozenset()):
+    # Freeze check using walls and crates only, so whatever it proves holds
+    # on any level. Crates already under test count as walls, which is what
+    # catches mutually blocking pairs and 2x2 blocks.
+    blocked = blocked | {crate}
+    walls, frozen = set(), {crate}
+    for axis in AXES:
+        proof = _find_blocker(analysis, crate, axis, crates, blocked)
+        if proof is None:
+            return None
+        walls |= proof[0]
+        frozen |= proof[1]
+    return walls, frozen
+
+
+def _find_blocker(analysis, crate, axis, crates, blocked):
+    for direction in axis:
+        neighbour = shift(crate, direction)
+        if not analysis.is_floor(neighbour):
+            return {neighbour}, set()
+        if neighbour in blocked:
+            return set(), {neighbour}
+    for direction in axis:
+        neighbour = shift(crate, direction)
+        if neighbour in crates:
+            proof = find_frozen(analysis, neighbour, crates, blocked)
+            if proof is not None:
+                return proof
+    return None
+
+
+class DeadlockPattern:
+
+    def __init__(self, walls, crates):
+        self.walls = frozenset(walls)
+        self.crates = frozenset(crates)
+
+    @staticmethod
+    def create(origin, walls, crates):
+        ox, oy = origin
+        return DeadlockPattern({(x - ox, y - oy) for x, y in walls},
+                               {(x - ox, y - oy) for x, y in crates})
+
+    def matches(self, analysis, origin, crates):
+        placed = [shift(origin, offset) for offset in self.crates]
+        if not all(position in crates for position in placed):
+            return False
+        if all(position in analysis.goals for position in placed):
+            return False
+        return not any(analysis.is_floor(shift(origin, offset))
+                       for offset in self.walls)
+
+    def get_key(self):
+        key = ''
+        for offset in AROUND:
+            if offset in self.walls:
+                key += WALL
+            elif offset in self.crates:
+                key += CRATE
+            else:
+                key += ANY
+        return key
+
+    def marshall(self):
+        return [sorted(self.walls), sorted(self.crates)]
+
+    @staticmethod
+    def unmarshall(data):
+        walls, crates = data
+        return DeadlockPattern(map(tuple, walls), map(tuple, crates))
+
+    def __eq__(self, other):
+        return (self.walls, self.crates) == (other.walls, other.crates)
+
+    def __hash__(self):
+        return hash((self.walls, self.crates))
+
+
+class DeadlockStore:
+    FILE = 'deadlocks.json'
+
+    def __init__(self, path=None):
+        if path is None:
+            path = Settings.get_path(DeadlockStore.FILE)
+        self.path = path
+        self.patterns = {}
+        self.lookups = 0
+        self.hits = 0
+        self.learned = 0
+        self.pruned = 0
+
+    @staticmethod
+    def get_probes(analysis, crate, crates):
+        # Keys of every pattern that could fit around ``crate``: each square
+        # is either used by the pattern as it is, or not used at all.
+        choices = []
+        for offset in AROUND:
+            position = shift(crate, offset)
+            if not analysis.is_floor(position):
+                choices.append((WALL, ANY))
+            elif position in crates:
+                choices.append((CRATE, ANY))
+            else:
+                choices.append((ANY,))
+        return map(''.join, itertools.product(*choices))
+
+    def is_dead(self, analysis, crate, crates):
+        self.lookups += 1
+        for key in DeadlockStore.get_probes(analysis, crate, crates):
+            for pattern in self.patterns.get(key, ()):
+                if pattern.matches(analysis, crate, crates):
+                    self.hits += 1
+                    self.pruned += 1
+                    return True
+
+        proof = find_frozen(analysis, crate, crates)
+        if proof is None:
+            return False
+        walls, frozen = proof
+        if frozen <= analysis.goals:
+            return False
+        if self.add(DeadlockPattern.create(crate, walls, frozen)):
+            self.learned += 1
+        self.pruned += 1
+        return True
+
+    def add(self, pattern):
+        bucket = self.patterns.setdefault(pattern.get_key(), set())
+        if pattern in bucket:
+            return False
+        bucket.add(pattern)
+        return True
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.patterns.values())
+
+    def get_hit_rate(self):
+        if not self.lookups:
+            return 0.0
+        return self.hits / self.lookups
+
+    def get_stats(self):
+        return {'patterns': len(self),
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'hit_rate': self.get_hit_rate(),
+                'learned': self.learned,
+                'pruned': self.pruned}
+
+    def load(self):
+        if not exists(self.path):
+            return self
+        # An unreadable store is treated as empty; the next save() writes a
+        # fresh file in its place.
+        try:
+            with open(self.path, 'r') as store_file:
+                loaded = [DeadlockPattern.unmarshall(pattern)
+                          for patterns in json.load(store_file).values()
+                          for pattern in patterns]
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            logger.warning('Ignoring unreadable deadlock store %s: %s',
+                           self.path, e)
+            return self
+        for pattern in loaded:
+            self.add(pattern)
+        return self
+
+    def save(self):
+        # Merge with whatever other processes stored in the meantime and
+        # replace the file in one step so readers never see half of it. The
+        # lock keeps two writers from both merging the same old file.
+        os.makedirs(dirname(self.path), exist_ok=True)
+        with open('{}.lock'.format(self.path), 'w') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            on_disk = DeadlockStore(self.path).load()
+            for bucket in on_disk.patterns.values():
+                for pattern in bucket:
+                    self.add(pattern)
+            temp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+            with open(temp_path, 'w') as store_file:
+                json.dump({key: sorted(pattern.marshall()
+                                       for pattern in bucket)
+                           for key, bucket in self.patterns.items()},
+                          store_file)
+            os.replace(temp_path, self.path)
@@ -2,7 +2,7 @@ import json
 import os
 
 from os.path import (join,
-                     expanduser, dirname)
+                     expanduser, dirname, basename)
 
 
 class Settings:
@@ -97,9 +97,15 @@ class LevelHandler:
             f.write('\n')
 
     def list_levels(self):
-        for root, dirs, files in os.walk(join(dirname(__file__),
-                                              Settings.MAPS)):
-            for f in files:
+        return LevelHandler.list_directory(join(dirname(__file__),
+                                                Settings.MAPS))
+
+    @staticmethod
+    def list_directory(path):
+        if os.path.isfile(path):
+            yield basename(path), path
+        for root, dirs, files in os.walk(path):
+            for f in sorted(files):
                 yield f, join(root, f)
 
     def list_saves(self):
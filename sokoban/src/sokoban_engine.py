@@ -9,7 +9,8 @@ from .constants import (STOREKEEPER,
                         WALL,
                         FINAL_POSITION,
                         FLOOR,
-                        VALID_CHARACTERS)
+                        VALID_CHARACTERS,
+                        LURD)
 
 
 class InvalidPlanException(Exception):
@@ -208,6 +209,11 @@ class Storage:
             lines.append(line)
         return lines
 
+    def replay(self, lurd):
+        directions = {char: direction for direction, char in LURD.items()}
+        for char in lurd:
+            self.get_player().move(directions[char.lower()])
+
     def is_on_final(self, position):
         return position in self.final_positions
 
@@ -313,6 +319,8 @@ class Storage:
 
     @staticmethod
     def validate(plan):
+        if not plan:
+            raise InvalidPlanException('Plan is empty!')
         players = 0
         final_positions = 0
         crates = 0
@@ -0,0 +1,190 @@
+import time
+
+from .analysis import LevelAnalysis
+
+
+class SearchResult:
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.lurd = None
+        self.nodes = 0
+        self.forward_frontier = 0
+        self.backward_frontier = 0
+        self.forward_depth = 0
+        self.backward_depth = 0
+        self.exhausted = False
+
+    def is_solved(self):
+        return self.lurd is not None
+
+    def get_meeting_depth(self):
+        return self.forward_depth + self.backward_depth
+
+    def get_pushes(self):
+        if self.lurd is None:
+            return None
+        return sum(1 for char in self.lurd if char.isupper())
+
+    def get_moves(self):
+        if self.lurd is None:
+            return None
+        return len(self.lurd)
+
+    def marshall(self):
+        return {'mode': self.mode,
+                'solution': self.lurd,
+                'pushes': self.get_pushes(),
+                'moves': self.get_moves(),
+                'nodes': self.nodes,
+                'forward_frontier': self.forward_frontier,
+                'backward_frontier': self.backward_frontier,
+                'forward_depth': self.forward_depth,
+                'backward_depth': self.backward_depth,
+                'exhausted': self.exhausted}
+
+
+class Solver:
+    FORWARD = 'forward'
+    BIDIRECTIONAL = 'bidirectional'
+    MODES = (FORWARD, BIDIRECTIONAL)
+
+    def __init__(self, analysis, mode=FORWARD, max_nodes=None,
+                 deadlocks=None, time_limit=None, started=None):
+        if mode not in Solver.MODES:
+            raise ValueError('Unknown search mode: {}'.format(mode))
+        self.analysis = analysis
+        self.mode = mode
+        self.max_nodes = max_nodes
+        self.deadlocks = deadlocks
+        self.time_limit = time_limit
+        self.started = started
+        self._deadline = None
+
+    @staticmethod
+    def create(plan, mode=FORWARD, max_nodes=None, deadlocks=None,
+               time_limit=None):
+        # The time limit covers the level analysis as well as the search.
+        started = time.monotonic()
+        deadline = None
+        if time_limit is not None:
+            deadline = started + time_limit
+        return Solver(LevelAnalysis.create(plan, deadline), mode, max_nodes,
+                      deadlocks, time_limit, started)
+
+    def solve(self):
+        if self.time_limit is not None:
+            started = self.started
+            if started is None:
+                started = time.monotonic()
+            self._deadline = started + self.time_limit
+        if self.mode == Solver.BIDIRECTIONAL:
+            return self._solve_bidirectional()
+        return self._solve_forward()
+
+    def _successors(self, state):
+        for move, successor in self.analysis.successors(state):
+            if (self.deadlocks is None
+                    or not self.deadlocks.is_dead(self.analysis,
+                                                  move.get_destination(),
+                                                  successor.crates)):
+                yield move, successor
+
+    def _is_late(self):
+        return (self._deadline is not None
+                and time.monotonic() >= self._deadline)
+
+    def _is_exhausted(self, result):
+        if self.max_nodes is not None and result.nodes >= self.max_nodes:
+            result.exhausted = True
+        elif self._is_late():
+            result.exhausted = True
+        return result.exhausted
+
+    def _solve_forward(self):
+        result = SearchResult(self.mode)
+        analysis = self.analysis
+        start = analysis.normalize(analysis.initial_state)
+        forward = {start: None}
+        layer = [start]
+        while layer:
+            result.forward_frontier = len(layer)
+            result.nodes = len(forward)
+            for state in layer:
+                if analysis.is_solved(state):
+                    return self._finish(result, forward, {}, state)
+            if self._is_exhausted(result):
+                break
+            layer = self._expand(layer, forward, self._successors)
+            result.forward_depth += 1
+        self._is_exhausted(result)
+        return result
+
+    def _solve_bidirectional(self):
+        result = SearchResult(self.mode)
+        analysis = self.analysis
+        start = analysis.normalize(analysis.initial_state)
+        forward = {start: None}
+        backward = {state: None for state in analysis.goal_states()}
+        forward_layer = [start]
+        backward_layer = list(backward)
+        meeting = start if start in backward else None
+        while meeting is None and forward_layer and backward_layer:
+            result.nodes = len(forward) + len(backward)
+            if self._is_exhausted(result):
+                break
+            # Always grow the cheaper side, one full layer at a time.
+            if len(forward_layer) <= len(backward_layer):
+                forward_layer = self._expand(forward_layer, forward,
+                                             self._successors)
+                result.forward_depth += 1
+                meeting = self._meet(forward_layer, backward)
+            else:
+                backward_layer = self._expand(backward_layer, backward,
+                                              analysis.predecessors)
+                result.backward_depth += 1
+                meeting = self._meet(backward_layer, forward)
+        result.forward_frontier = len(forward_layer)
+        result.backward_frontier = len(backward_layer)
+        result.nodes = len(forward) + len(backward)
+        if meeting is None:
+            self._is_exhausted(result)
+            return result
+        return self._finish(result, forward, backward, meeting)
+
+    def _expand(self, layer, visited, neighbours):
+        next_layer = []
+        for state in layer:
+            if self._is_late():
+                break
+            for move, neighbour in neighbours(state):
+                neighbour = self.analysis.normalize(neighbour)
+                if neighbour not in visited:
+                    visited[neighbour] = state, move
+                    next_layer.append(neighbour)
+        return next_layer
+
+    @staticmethod
+    def _meet(layer, visited):
+        for state in layer:
+            if state in visited:
+                return state
+        return None
+
+    def _finish(self, result, forward, backward, meeting):
+        moves = []
+        state = meeting
+        while forward[state] is not None:
+            state, move = forward[state]
+            moves.append(move)
+        moves.reverse()
+        result.forward_depth = len(moves)
+
+        state = meeting
+        while backward.get(state) is not None:
+            state, move = backward[state]
+            moves.append(move)
+        result.backward_depth = len(moves) - result.forward_depth
+
+        result.lurd = self.analysis.expand(self.analysis.initial_state, moves)
+        return result